@@ -0,0 +1,85 @@
+"""Benchmark: derived metrics with pandas expressions vs metrics.compute_metrics
+
+The pandas path below is the same expression-by-expression code as index.py,
+with the cumulative sums done per location. It is used both as the baseline
+for timing and as the reference the kernel results are checked against.
+
+Both runs pay for turning the location names into group codes (pandas in
+groupby, compute_metrics in pd.factorize). With plain string locations that
+step is most of the time, so the same data is also timed with a categorical
+location column, where the codes come for free.
+
+Run with: python bench_metrics.py [n_locations] [n_days]
+"""
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from metrics import BACKENDS, METRIC_COLUMNS, compute_metrics
+
+initial_tests = 935_310
+
+
+def make_data(n_locations, n_days, seed=0):
+    """Daywise data shaped like italy-covid-daywise.csv, for several locations"""
+    rng = np.random.default_rng(seed)
+    n = n_locations * n_days
+    df = pd.DataFrame({
+        "location": np.repeat([f"loc{i}" for i in range(n_locations)], n_days),
+        "new_cases": rng.poisson(1000, n).astype(float),
+        "new_deaths": rng.poisson(50, n).astype(float),
+        "new_tests": rng.poisson(30000, n).astype(float),
+        "population": np.repeat(rng.integers(1_000_000, 100_000_000, n_locations), n_days).astype(float),
+    })
+    # Like Italy, tests were only reported after a while, plus a few random gaps
+    day = np.tile(np.arange(n_days), n_locations)
+    df.loc[day < n_days // 2, "new_tests"] = np.nan
+    df.loc[rng.random(n) < 0.01, "new_cases"] = np.nan
+    # Zero cases/tests on some days to check the division by zero semantics
+    df.loc[rng.random(n) < 0.01, "new_tests"] = 0.0
+    df.loc[day == 0, "new_cases"] = 0.0
+    return df
+
+
+def pandas_metrics(df, initial_tests=initial_tests):
+    result = pd.DataFrame(index=df.index)
+    if "location" in df.columns:
+        by_location = df.groupby("location", sort=False)
+    else:
+        by_location = df
+    result["positive_rate"] = df.new_cases / df.new_tests
+    result["total_cases"] = by_location.new_cases.cumsum()
+    result["total_deaths"] = by_location.new_deaths.cumsum()
+    result["total_tests"] = by_location.new_tests.cumsum() + initial_tests
+    result["cases_per_million"] = result.total_cases * 1e6 / df.population
+    result["deaths_per_million"] = result.total_deaths * 1e6 / df.population
+    result["tests_per_million"] = result.total_tests * 1e6 / df.population
+    result["death_rate"] = result.total_deaths / result.total_cases
+    result["cumulative_positive_rate"] = result.total_cases / result.total_tests
+    return result
+
+
+def main(n_locations=200, n_days=250, repeat=5):
+    for location_dtype in ("str", "category"):
+        df = make_data(n_locations, n_days)
+        df["location"] = df.location.astype(location_dtype)
+        print(f"{len(df)} rows, {n_locations} locations, location dtype {location_dtype}")
+
+        # The accuracy checks with nastier data are in test_metrics.py
+        expected = pandas_metrics(df)
+        runs = {"pandas": lambda: pandas_metrics(df)}
+        for backend in BACKENDS:
+            result = compute_metrics(df, initial_tests, backend=backend)
+            pd.testing.assert_frame_equal(result, expected[METRIC_COLUMNS], rtol=1e-14)
+            runs[backend] = lambda backend=backend: compute_metrics(df, initial_tests, backend=backend)
+
+        baseline = None
+        for name, run in runs.items():
+            best = min(timeit.repeat(run, number=1, repeat=repeat))
+            baseline = baseline or best
+            print(f"{name:>8}: {best * 1000:8.2f} ms  ({baseline / best:5.1f}x)")
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:3]))
@@ -0,0 +1,196 @@
+"""Derived covid metrics computed by one kernel per backend
+
+index.py builds the derived columns one pandas expression at a time, e.g.
+
+covid_df["total_cases"] = covid_df.new_cases.cumsum()
+merged_df["cases_per_million"] = merged_df.total_cases * 1e6 / merged_df.population
+
+and every one of those allocates its own temporary Series. Here all of the
+derived columns are written into a single (len(METRIC_COLUMNS) x n_rows) output
+array, which the caller can allocate up front and reuse. Two backends are
+provided:
+
+* "numba" - a jitted loop that walks the rows once, used when numba is installed
+* "numpy" - whole-array NumPy operations: the three running totals are done
+  together, one cumsum per location, and the ratios are computed in place in
+  the output array. This saves temporaries but still makes several passes over
+  the data (plus a sort if the locations are interleaved), so on large inputs
+  it is only slightly faster than the pandas expressions (about 1.1-1.6x in
+  bench_metrics.py). It is there as a fallback, not as the fast path.
+
+For both backends, turning string locations into group codes with
+pd.factorize is a big part of the time on large inputs; a categorical
+location column avoids most of that cost.
+
+The results match the pandas expressions, including NaN handling: cumsum skips
+NaN (the running total carries on, but the row itself stays NaN), rows with a
+missing location get NaN totals, and division by zero gives inf/NaN instead of
+raising.
+"""
+import numpy as np
+import pandas as pd
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Output columns, in the order the kernels fill them
+METRIC_COLUMNS = [
+    "positive_rate",
+    "total_cases",
+    "total_deaths",
+    "total_tests",
+    "cases_per_million",
+    "deaths_per_million",
+    "tests_per_million",
+    "death_rate",
+    "cumulative_positive_rate",
+]
+
+
+def _numpy_kernel(codes, n_groups, new_cases, new_deaths, new_tests,
+                  population, initial_tests, out):
+    """Fill out (len(METRIC_COLUMNS) x n_rows) using NumPy only."""
+    totals = out[1:4]
+    per_million = out[4:7]
+
+    # Running totals need the rows of each location next to each other. Rows
+    # from pd.factorize are usually already grouped, so only sort when needed.
+    if np.all(codes[1:] >= codes[:-1]):
+        order = None
+        sorted_codes = codes
+        totals[0] = new_cases
+        totals[1] = new_deaths
+        totals[2] = new_tests
+    else:
+        order = np.argsort(codes, kind="stable")
+        sorted_codes = codes[order]
+        np.take(new_cases, order, out=totals[0])
+        np.take(new_deaths, order, out=totals[1])
+        np.take(new_tests, order, out=totals[2])
+
+    missing = np.isnan(totals)
+    totals[missing] = 0.0
+    # Rows without a location don't belong to any running total
+    missing[:, sorted_codes < 0] = True
+
+    # One cumsum per location, so totals never leak from one location to the next
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    stops = np.r_[starts[1:], len(sorted_codes)]
+    if np.all(stops - starts == stops[0]):
+        # Same number of days for every location: all segments in one call
+        blocks = totals.reshape(3, len(starts), stops[0])
+        np.cumsum(blocks, axis=2, out=blocks)
+    else:
+        for start, stop in zip(starts, stops):
+            segment = totals[:, start:stop]
+            np.cumsum(segment, axis=1, out=segment)
+    totals[missing] = np.nan
+
+    if order is not None:
+        totals[:, order] = totals.copy()
+    totals[2] += initial_tests
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.divide(new_cases, new_tests, out=out[0])
+        np.multiply(totals, 1e6, out=per_million)
+        np.divide(per_million, population, out=per_million)
+        np.divide(totals[1], totals[0], out=out[7])
+        np.divide(totals[0], totals[2], out=out[8])
+
+
+def _loop_kernel(codes, n_groups, new_cases, new_deaths, new_tests,
+                 population, initial_tests, out):
+    """Fill out (len(METRIC_COLUMNS) x n_rows) in a single pass over the rows."""
+    cases_acc = np.zeros(n_groups)
+    deaths_acc = np.zeros(n_groups)
+    tests_acc = np.zeros(n_groups)
+    nan = np.nan
+
+    for i in range(codes.shape[0]):
+        g = codes[i]
+        cases = new_cases[i]
+        deaths = new_deaths[i]
+        tests = new_tests[i]
+        pop = population[i]
+
+        total_cases = nan
+        total_deaths = nan
+        total_tests = nan
+        # Rows without a location (code -1) don't belong to any running total
+        if g >= 0:
+            if cases == cases:
+                cases_acc[g] += cases
+                total_cases = cases_acc[g]
+            if deaths == deaths:
+                deaths_acc[g] += deaths
+                total_deaths = deaths_acc[g]
+            if tests == tests:
+                tests_acc[g] += tests
+                total_tests = tests_acc[g] + initial_tests
+
+        out[0, i] = cases / tests
+        out[1, i] = total_cases
+        out[2, i] = total_deaths
+        out[3, i] = total_tests
+        out[4, i] = total_cases * 1e6 / pop
+        out[5, i] = total_deaths * 1e6 / pop
+        out[6, i] = total_tests * 1e6 / pop
+        out[7, i] = total_deaths / total_cases
+        out[8, i] = total_cases / total_tests
+
+
+BACKENDS = {"numpy": _numpy_kernel}
+
+if numba is not None:
+    # error_model="numpy" so that x / 0.0 gives inf/NaN like pandas does
+    BACKENDS["numba"] = numba.njit(cache=True, error_model="numpy")(_loop_kernel)
+
+
+def default_backend():
+    return "numba" if "numba" in BACKENDS else "numpy"
+
+
+def compute_metrics(df, initial_tests=0, backend=None, out=None):
+    """Return a data frame with the METRIC_COLUMNS for each row of df.
+
+    df needs the new_cases, new_deaths, new_tests and population columns. If
+    it has a location column, running totals are kept separately for each
+    location (the rows don't have to be grouped or sorted), and rows with a
+    missing location get NaN totals, like groupby(...).cumsum(). initial_tests
+    is added to total_tests, like the 935310 tests Italy did before it started
+    reporting daily numbers.
+
+    out can be a preallocated C-contiguous float64 array of shape
+    (len(METRIC_COLUMNS), len(df)). The kernels write into it and the returned
+    data frame is a view of it, so no extra copy is made.
+    """
+    backend = backend or default_backend()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {sorted(BACKENDS)}")
+    kernel = BACKENDS[backend]
+
+    n_rows = len(df)
+    shape = (len(METRIC_COLUMNS), n_rows)
+    if out is None:
+        out = np.empty(shape)
+    elif out.shape != shape or out.dtype != np.float64 or not out.flags.c_contiguous:
+        raise ValueError(f"out must be a C-contiguous float64 array of shape {shape}")
+
+    if "location" in df.columns:
+        codes, uniques = pd.factorize(df.location)
+        n_groups = len(uniques)
+    else:
+        codes = np.zeros(n_rows, dtype=np.intp)
+        n_groups = 1
+    codes = np.ascontiguousarray(codes, dtype=np.intp)
+
+    def column(name):
+        return np.ascontiguousarray(df[name].to_numpy(dtype=np.float64, na_value=np.nan))
+
+    if n_rows:
+        kernel(codes, n_groups, column("new_cases"), column("new_deaths"),
+               column("new_tests"), column("population"), float(initial_tests), out)
+
+    return pd.DataFrame(out.T, columns=METRIC_COLUMNS, index=df.index, copy=False)
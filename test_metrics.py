@@ -0,0 +1,95 @@
+"""Check every metrics backend against the pandas expressions in bench_metrics.py"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from bench_metrics import make_data, pandas_metrics
+from metrics import BACKENDS, METRIC_COLUMNS, compute_metrics
+
+backends = pytest.mark.parametrize("backend", sorted(BACKENDS))
+
+
+def check(df, backend, initial_tests=935_310):
+    expected = pandas_metrics(df, initial_tests)[METRIC_COLUMNS]
+    with np.errstate(all="raise"):
+        result = compute_metrics(df, initial_tests, backend=backend)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False, rtol=1e-14)
+    return result
+
+
+def frame(location, new_cases, new_deaths=None, new_tests=None, population=None):
+    n = len(new_cases)
+    df = pd.DataFrame({
+        "location": location,
+        "new_cases": new_cases,
+        "new_deaths": new_deaths if new_deaths is not None else np.arange(n, dtype=float),
+        "new_tests": new_tests if new_tests is not None else np.full(n, 100.0),
+        "population": population if population is not None else np.full(n, 60e6),
+    })
+    return df if location is not None else df.drop(columns="location")
+
+
+@backends
+def test_synthetic_data(backend):
+    check(make_data(5, 40), backend)
+
+
+@backends
+def test_different_magnitudes(backend):
+    rng = np.random.default_rng(1)
+    big = rng.random(50) * 1e12
+    small = rng.random(50) * 1e-3
+    df = frame(["big"] * 50 + ["small"] * 50, np.r_[big, small],
+               new_deaths=np.r_[small, big], new_tests=np.r_[big, small] * 7.5)
+    check(df, backend)
+
+
+@backends
+def test_inf_stays_in_its_location(backend):
+    df = frame(["a", "a", "b", "b"], [1.0, np.inf, 2.0, 3.0])
+    result = check(df, backend)
+    assert result.total_cases.tolist() == [1.0, np.inf, 2.0, 5.0]
+
+
+@backends
+def test_missing_location(backend):
+    df = frame(["a", None, "b", "b"], [1.0, 4.0, 2.0, 3.0])
+    result = check(df, backend)
+    assert result.total_cases.tolist()[::2] == [1.0, 2.0]
+    assert np.isnan(result.total_cases[1])
+
+
+@backends
+def test_interleaved_locations(backend):
+    df = frame(["b", "a", "b", None, "a", "c", "b"],
+               [1.0, 2.0, np.nan, 4.0, 5.0, 0.0, 7.0],
+               new_tests=[10.0, np.nan, 0.0, 5.0, 20.0, 0.0, 30.0])
+    check(df, backend)
+
+
+@backends
+def test_no_location_column(backend):
+    df = frame(None, [0.0, np.nan, 2.5, 3.5], new_tests=[np.nan, 0.0, 4.0, 8.0])
+    check(df, backend)
+
+
+@backends
+def test_empty(backend):
+    df = frame([], np.array([], dtype=float))
+    result = check(df, backend)
+    assert list(result.columns) == METRIC_COLUMNS
+
+
+@backends
+def test_out_is_used_without_copy(backend):
+    df = make_data(3, 10)
+    out = np.empty((len(METRIC_COLUMNS), len(df)))
+    result = compute_metrics(df, backend=backend, out=out)
+    assert np.shares_memory(result.to_numpy(), out)
+    with pytest.raises(ValueError):
+        compute_metrics(df, backend=backend, out=np.empty((len(df), len(METRIC_COLUMNS))))
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        compute_metrics(make_data(1, 5), backend="cuda")